@@ -1,7 +1,9 @@
 from typing import List
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 class BotConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     # --- Exchange Settings (OKX) ---
     OKX_API_KEY: str = ""
     OKX_SECRET_KEY: str = ""
@@ -25,4 +27,6 @@ class BotConfig(BaseModel):
 
     # --- System ---
     UPDATE_INTERVAL_SECONDS: int = 300
+    MAX_CONCURRENCY: int = Field(4, ge=1) # Symbols debated in parallel per cycle
+    TACTICS_CACHE_ENABLED: bool = True # Set False to debate every cycle (debugging)
     WEB_PASSWORD: str = "admin" # Simple security for the web UI
@@ -1,13 +1,65 @@
+# Runtime: the engine is pure asyncio I/O (ccxt over aiohttp). The Procfile pins uvicorn to
+# `--loop uvloop`, which fails at startup if uvloop is missing rather than falling back. uvloop
+# is not installed on Windows (requirements marker), so run there with uvicorn's default loop.
 import ccxt.async_support as ccxt
-import pandas as pd
-import pandas_ta as ta
+import aiohttp
+import certifi
+import numpy as np
 import asyncio
-from typing import Dict, Any
+import ssl
+import time
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 from config import BotConfig
 
 logger = logging.getLogger("sentinel.engine")
 
+# Indicator periods and their smoothing constants (precomputed once)
+RSI_LENGTH = 14
+ATR_LENGTH = 14
+EMA_FAST = 20
+EMA_SLOW = 50
+_EMA_FAST_ALPHA = 2.0 / (EMA_FAST + 1)
+_EMA_SLOW_ALPHA = 2.0 / (EMA_SLOW + 1)
+
+HISTORY_BARS = 100  # Candles fetched on cold start
+WARM_BARS = 3       # Minimum candles fetched once a symbol's indicator state is seeded
+QUOTE_TTL_SECONDS = 30  # Reuse window for ticker / order book fields
+
+# Order book imbalance labels, indexed by (ratio > 1.5) - (ratio < 0.6) + 1
+_OB_LABELS = ("STRONG_SELL_WALL", "NEUTRAL", "STRONG_BUY_WALL")
+
+def _smooth_last(values: np.ndarray, alpha: float, length: int) -> float:
+    """
+    Final value of an SMA-seeded exponential smoothing (EMA / Wilder RMA).
+    The recurrence is unrolled into one dot product instead of a Python loop.
+    """
+    tail = values[length:]
+    decay = 1.0 - alpha
+    weights = alpha * decay ** np.arange(len(tail) - 1, -1, -1)
+    return float(decay ** len(tail) * values[:length].mean() + weights @ tail)
+
+# One keep-alive connection pool shared by every DataEngine; closed only on app shutdown
+_shared_session: Optional[aiohttp.ClientSession] = None
+
+def _get_shared_session() -> aiohttp.ClientSession:
+    global _shared_session
+    if _shared_session is None or _shared_session.closed:
+        connector = aiohttp.TCPConnector(
+            ssl=ssl.create_default_context(cafile=certifi.where()),
+            limit=64,
+            keepalive_timeout=90,
+            ttl_dns_cache=300,
+        )
+        _shared_session = aiohttp.ClientSession(connector=connector)
+    return _shared_session
+
+async def close_shared_session():
+    global _shared_session
+    if _shared_session is not None:
+        await _shared_session.close()
+        _shared_session = None
+
 class DataEngine:
     def __init__(self, config: BotConfig):
         self.config = config
@@ -25,13 +77,30 @@ class DataEngine:
             'password': passphrase,
             'options': {'defaultType': 'swap'},  # Perpetual Swap
             'enableRateLimit': True,
+            # Externally owned session: exchange.close() leaves it open for the next engine
+            'session': _get_shared_session(),
         })
         if config.IS_SANDBOX:
             self.exchange.set_sandbox_mode(True)
 
+        # Per-symbol indicator state as of the last *closed* candle
+        self._symbol_state: Dict[str, Dict[str, Any]] = {}
+        # Tickers / funding rates fetched in bulk once per scan
+        self._bulk_cache: Dict[str, Any] = {}
+        # (time bucket, value) per symbol: whole snapshots and candle-aligned indicators
+        self._snap_cache: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._ind_cache: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+        self._timeframe_seconds = self.exchange.parse_timeframe(config.TIMEFRAME)
+        # Minimum order amount per traded symbol, filled after load_markets()
+        self._min_amount: Dict[str, float] = {}
+
     async def initialize(self):
         try:
             await self.exchange.load_markets()
+            self._min_amount = {
+                s: self.exchange.market(s)['limits']['amount']['min'] or 0.0
+                for s in self.config.TRADING_SYMBOLS if s in self.exchange.markets
+            }
             logger.info("[交易所] OKX 连接已初始化")
         except Exception as e:
             logger.error(f"[交易所] 连接 OKX 失败: {e}")
@@ -43,32 +112,23 @@ class DataEngine:
     async def fetch_market_snapshot(self, symbol: str) -> Dict[str, Any]:
         """
         Fetches comprehensive market data for the AI context.
+        Snapshots are reused for QUOTE_TTL_SECONDS; indicators for the lifetime of the current candle.
         """
+        quote_bucket = int(time.monotonic() // QUOTE_TTL_SECONDS)
+        cached = self._snap_cache.get(symbol)
+        if cached and cached[0] == quote_bucket:
+            return cached[1]
+
         try:
             # Parallel fetch for speed
-            ohlcv_task = self.exchange.fetch_ohlcv(symbol, self.config.TIMEFRAME, limit=100)
-            ticker_task = self.exchange.fetch_ticker(symbol)
-            funding_task = self.exchange.fetch_funding_rate(symbol)
-            ob_task = self.exchange.fetch_order_book(symbol, limit=20)
-
-            ohlcv, ticker, funding, ob = await asyncio.gather(
-                ohlcv_task, ticker_task, funding_task, ob_task
+            technical, ticker, funding, ob = await asyncio.gather(
+                self._fetch_technical(symbol),
+                self._fetch_ticker(symbol),
+                self._fetch_funding_rate(symbol),
+                self.exchange.fetch_order_book(symbol, limit=20)
             )
 
-            # Process OHLCV into DataFrame with Indicators
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-            
-            # Technical Indicators
-            df['atr'] = df.ta.atr(length=14)
-            df['rsi'] = df.ta.rsi(length=14)
-            df['ema_20'] = df.ta.ema(length=20)
-            df['ema_50'] = df.ta.ema(length=50)
-
-            last_row = df.iloc[-1]
-            prev_row = df.iloc[-2]
-
-            return {
+            snapshot = {
                 "symbol": symbol,
                 "price": ticker['last'],
                 "bid": ob['bids'][0][0],
@@ -76,29 +136,155 @@ class DataEngine:
                 "spread_pct": (ob['asks'][0][0] - ob['bids'][0][0]) / ob['bids'][0][0],
                 "funding_rate": funding['fundingRate'],
                 "vol_24h": ticker['quoteVolume'],
-                "technical": {
-                    "rsi": last_row['rsi'],
-                    "atr": last_row['atr'],
-                    "ema_trend": "BULLISH" if last_row['ema_20'] > last_row['ema_50'] else "BEARISH",
-                    "close": last_row['close'],
-                    "prev_close": prev_row['close']
-                },
+                "technical": technical,
                 "orderbook_imbalance": self._calc_ob_imbalance(ob)
             }
+            self._snap_cache[symbol] = (quote_bucket, snapshot)
+            return snapshot
         except Exception as e:
             logger.error(f"[交易所] 获取 {symbol} 数据出错: {e}")
             return None
 
-    def _calc_ob_imbalance(self, ob) -> str:
+    async def _fetch_technical(self, symbol: str) -> Dict[str, Any]:
+        candle_bucket = int(time.time() // self._timeframe_seconds)
+        cached = self._ind_cache.get(symbol)
+        if cached and cached[0] == candle_bucket:
+            return cached[1]
+
+        timeframe_ms = self._timeframe_seconds * 1000
+        state = self._symbol_state.get(symbol)
+        limit = HISTORY_BARS
+        if state:
+            # Candles opened since the last seeded one (including the forming one), plus that candle itself
+            elapsed = candle_bucket - int(state['ts']) // timeframe_ms
+            if elapsed + 1 < HISTORY_BARS:
+                limit = max(WARM_BARS, elapsed + 1)
+            else:
+                # Offline longer than the history window: nothing left to fold in incrementally
+                state = None
+        ohlcv = await self.exchange.fetch_ohlcv(symbol, self.config.TIMEFRAME, limit=limit)
+
+        if state and ohlcv[0][0] > state['ts'] + timeframe_ms:
+            # The exchange skipped candles right after the seeded one: reseed from full history
+            logger.info(f"[交易所] {symbol} K线出现缺口，重新计算指标")
+            state = None
+            ohlcv = await self.exchange.fetch_ohlcv(symbol, self.config.TIMEFRAME, limit=HISTORY_BARS)
+
+        if state is None:
+            # Closed candles as one float64 (rows, 6) block; the seed kernels read its columns
+            state = self._seed_indicators(np.asarray(ohlcv[:-1], dtype=np.float64))
+        else:
+            # Fold in candles that closed since the last poll; the last one is still forming
+            for candle in ohlcv[:-1]:
+                if candle[0] > state['ts']:
+                    state = self._advance_indicators(state, candle)
+        self._symbol_state[symbol] = state
+
+        # Indicators for the forming candle are provisional and never stored
+        live = self._advance_indicators(state, ohlcv[-1])
+        avg_loss = live['avg_loss']
+        rsi = 100.0 if avg_loss == 0 else 100.0 - 100.0 / (1.0 + live['avg_gain'] / avg_loss)
+
+        technical = {
+            "rsi": rsi,
+            "atr": live['atr'],
+            "ema_trend": "BULLISH" if live['ema_20'] > live['ema_50'] else "BEARISH",
+            "close": live['close'],
+            "prev_close": state['close']
+        }
+        self._ind_cache[symbol] = (candle_bucket, technical)
+        return technical
+
+    async def fetch_all_snapshots(self, symbols: List[str]) -> List[Any]:
+        """
+        Fetches snapshots for all symbols concurrently; ccxt's rate limiter still paces the requests.
+        Failed symbols come back as None or as the raised exception.
+        """
+        await self.prime_bulk(symbols)
+        return await asyncio.gather(
+            *(self.fetch_market_snapshot(s) for s in symbols), return_exceptions=True
+        )
+
+    async def prime_bulk(self, symbols: List[str]):
+        """
+        Fetches tickers and funding rates for all symbols in one request each,
+        so the per-symbol snapshots only need OHLCV and the order book.
+        """
         try:
-            bid_vol = sum([x[1] for x in ob['bids'][:10]])
-            ask_vol = sum([x[1] for x in ob['asks'][:10]])
-            ratio = bid_vol / (ask_vol + 1e-9)
-            if ratio > 1.5: return "STRONG_BUY_WALL"
-            if ratio < 0.6: return "STRONG_SELL_WALL"
-            return "NEUTRAL"
-        except Exception:
+            tasks = [self.exchange.fetch_tickers(symbols)]
+            if self.exchange.has.get('fetchFundingRates'):
+                tasks.append(self.exchange.fetch_funding_rates(symbols))
+            results = await asyncio.gather(*tasks)
+            self._bulk_cache = {
+                'ts': time.monotonic(),
+                'tickers': results[0],
+                'funding': results[1] if len(results) > 1 else {},
+            }
+        except Exception as e:
+            logger.warning(f"[交易所] 批量获取行情失败，回退到逐个请求: {e}")
+            self._bulk_cache = {}
+
+    def _bulk_entry(self, kind: str, symbol: str):
+        if not self._bulk_cache:
+            return None
+        if time.monotonic() - self._bulk_cache['ts'] > self.config.UPDATE_INTERVAL_SECONDS / 2:
+            return None
+        return self._bulk_cache[kind].get(symbol)
+
+    async def _fetch_ticker(self, symbol: str):
+        cached = self._bulk_entry('tickers', symbol)
+        return cached if cached is not None else await self.exchange.fetch_ticker(symbol)
+
+    async def _fetch_funding_rate(self, symbol: str):
+        cached = self._bulk_entry('funding', symbol)
+        return cached if cached is not None else await self.exchange.fetch_funding_rate(symbol)
+
+    def _seed_indicators(self, buf: np.ndarray) -> Dict[str, Any]:
+        """
+        Cold start: compute the smoothing state of the last closed candle from a (rows, 6) float64 block of closed candles.
+        """
+        high, low, close = buf[:, 2], buf[:, 3], buf[:, 4]
+        prev_close = close[:-1]
+        change = np.diff(close)
+        tr = np.maximum(high[1:] - low[1:], np.maximum(np.abs(high[1:] - prev_close), np.abs(low[1:] - prev_close)))
+        return {
+            'ts': int(buf[-1, 0]),
+            'close': float(close[-1]),
+            'ema_20': _smooth_last(close, _EMA_FAST_ALPHA, EMA_FAST),
+            'ema_50': _smooth_last(close, _EMA_SLOW_ALPHA, EMA_SLOW),
+            'avg_gain': _smooth_last(np.clip(change, 0.0, None), 1.0 / RSI_LENGTH, RSI_LENGTH),
+            'avg_loss': _smooth_last(np.clip(-change, 0.0, None), 1.0 / RSI_LENGTH, RSI_LENGTH),
+            'atr': _smooth_last(tr, 1.0 / ATR_LENGTH, ATR_LENGTH),
+        }
+
+    @staticmethod
+    def _advance_indicators(state: Dict[str, Any], candle) -> Dict[str, Any]:
+        """
+        Steps EMA / Wilder RSI / Wilder ATR forward by one candle in O(1).
+        """
+        ts, _, high, low, close, _ = candle
+        prev_close = state['close']
+        change = close - prev_close
+        tr = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        return {
+            'ts': ts,
+            'close': close,
+            'ema_20': _EMA_FAST_ALPHA * close + (1 - _EMA_FAST_ALPHA) * state['ema_20'],
+            'ema_50': _EMA_SLOW_ALPHA * close + (1 - _EMA_SLOW_ALPHA) * state['ema_50'],
+            'avg_gain': (state['avg_gain'] * (RSI_LENGTH - 1) + max(change, 0.0)) / RSI_LENGTH,
+            'avg_loss': (state['avg_loss'] * (RSI_LENGTH - 1) + max(-change, 0.0)) / RSI_LENGTH,
+            'atr': (state['atr'] * (ATR_LENGTH - 1) + tr) / ATR_LENGTH,
+        }
+
+    def _calc_ob_imbalance(self, ob) -> str:
+        bids = ob.get('bids') or ()
+        asks = ob.get('asks') or ()
+        if not bids or not asks:
             return "NEUTRAL"
+        bid_vol = np.asarray(bids[:10], dtype=np.float64)[:, 1].sum()
+        ask_vol = np.asarray(asks[:10], dtype=np.float64)[:, 1].sum()
+        ratio = float(bid_vol / (ask_vol + 1e-9))
+        return _OB_LABELS[(ratio > 1.5) - (ratio < 0.6) + 1]
 
     async def calculate_position_size(self, symbol: str, entry_price: float, stop_loss: float) -> float:
         """
@@ -111,15 +297,11 @@ class DataEngine:
 
         amount = self.config.MAX_RISK_PER_TRADE_USD / risk_per_unit
         
-        # Check min limits
-        try:
-            market = self.exchange.market(symbol)
-            min_amount = market['limits']['amount']['min']
-            if amount < min_amount:
-                logger.warning(f"[交易所] 计算的仓位 {amount} 低于最小限制 {min_amount}")
-                return 0.0
-        except Exception:
-            pass # Skip check if market info not available
+        # Check min limits (0.0 when market info is not available)
+        min_amount = self._min_amount.get(symbol, 0.0)
+        if amount < min_amount:
+            logger.warning(f"[交易所] 计算的仓位 {amount} 低于最小限制 {min_amount}")
+            return 0.0
             
         return amount
 
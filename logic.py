@@ -1,17 +1,49 @@
 
-import json
+import asyncio
 import logging
-from pydantic import BaseModel
-from typing import Optional, Literal, List
+import time
+from pydantic import BaseModel, ConfigDict
+from typing import Any, Optional, Literal, List, Dict, Tuple
 from google import genai 
 from openai import AsyncOpenAI
 from config import BotConfig
 
 logger = logging.getLogger("sentinel.logic")
 
+# Bounds applied to the auditor's confidence when used as a win probability
+_P_WIN_LO, _P_WIN_HI = 0.3, 0.7
+
+# (epoch second, "%H:%M:%S") of the last formatted timestamp
+_TS_CACHE: Tuple[int, str] = (0, "")
+
+def _timestamp() -> str:
+    global _TS_CACHE
+    now = int(time.time())
+    if _TS_CACHE[0] != now:
+        _TS_CACHE = (now, time.strftime("%H:%M:%S", time.localtime(now)))
+    return _TS_CACHE[1]
+
+def _market_key(market_data: dict) -> tuple:
+    """
+    Quantized market state: snapshots mapping to the same key get the same model answers.
+    RSI is floored to 5-point buckets whose edges sit on the 20/30/70/80 decision thresholds; the
+    strict `> 30` / `> 80` checks still split a bucket at exactly 30.0 / 80.0, where a reused answer
+    may come from the other side. Price keeps 4 significant digits so low-priced symbols do not
+    collapse to one key.
+    """
+    tech = market_data['technical']
+    return (
+        market_data['symbol'],
+        tech['ema_trend'],
+        int(tech['rsi'] // 5) * 5,
+        float(f"{market_data['price']:.4g}"),
+    )
+
 # --- 结构化输出定义 ---
 
 class StrategyProposal(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     symbol: str
     action: Literal["LONG", "SHORT", "WAIT"]
     entry_price: float
@@ -21,6 +53,8 @@ class StrategyProposal(BaseModel):
     confidence_score: int  # 0-100
 
 class AuditReport(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     approved: bool
     risk_flags: List[str]
     liquidity_check: str
@@ -41,6 +75,58 @@ class TacticalPlan(BaseModel):
     audit: Optional[AuditReport] = None
     dialogue: List[dict] = [] # 存储自然语言对话内容
 
+# Skeleton for WAIT / rejected plans; _adjudicate fills in the per-proposal fields
+_REJECT_TEMPLATE = TacticalPlan.model_construct(should_trade=False, expected_value=0.0)
+
+# --- 对话模板 ---
+
+_STRATEGIST_PITCH = ("strategist", "我观察到 {symbol} 当前处于 {reasoning}。这看起来是一个不错的机会。")
+_AUDITOR_AGREES = ("auditor", "我已审查该提议。{comment} 深度图和流动性也符合要求，我同意尝试。")
+_AUDITOR_OBJECTS = ("auditor", "我持反对意见。{comment} 现在的风险回报比并不理想。")
+_BOTH_WAIT = [
+    ("strategist", "目前市场波动较小或趋势不明朗，我建议继续观望。"),
+    ("auditor", "同意。盲目入场只会增加不必要的风险。"),
+]
+
+# (proposal.action, audit.approved) -> [(role, template)]
+_DIALOGUE_TEMPLATES = {
+    ("WAIT", False): _BOTH_WAIT,
+    ("WAIT", True): _BOTH_WAIT,
+    ("LONG", True): [_STRATEGIST_PITCH, _AUDITOR_AGREES],
+    ("LONG", False): [_STRATEGIST_PITCH, _AUDITOR_OBJECTS],
+    ("SHORT", True): [_STRATEGIST_PITCH, _AUDITOR_AGREES],
+    ("SHORT", False): [_STRATEGIST_PITCH, _AUDITOR_OBJECTS],
+}
+
+# should_trade -> adjudicator closing line
+_VERDICT_TEMPLATES = {
+    True: "基于双方陈述与数学计算，当前期望值 (EV) 为 {ev:.2f}，超过阈值。指令已下达，执行 {action} 策略。",
+    False: "虽然审计通过，但数学期望值仅为 {ev:.2f}，未达到系统要求的 {min_ev}。本次放弃执行。",
+}
+
+# --- 模型客户端池 ---
+
+# One client per API key for the life of the process, so restarting the bot
+# reuses the existing HTTP connection pools instead of building new ones.
+_GEMINI_CLIENTS: Dict[str, genai.Client] = {}
+_DEEPSEEK_CLIENTS: Dict[str, AsyncOpenAI] = {}
+
+def get_gemini_client(api_key: str) -> genai.Client:
+    client = _GEMINI_CLIENTS.get(api_key)
+    if client is None:
+        client = _GEMINI_CLIENTS[api_key] = genai.Client(api_key=api_key)
+    return client
+
+def get_deepseek_client(api_key: str) -> AsyncOpenAI:
+    client = _DEEPSEEK_CLIENTS.get(api_key)
+    if client is None:
+        client = _DEEPSEEK_CLIENTS[api_key] = AsyncOpenAI(
+            api_key=api_key,
+            base_url="https://api.deepseek.com/v1",
+            max_retries=1
+        )
+    return client
+
 # --- 对抗决策逻辑 ---
 
 class DebateManager:
@@ -52,21 +138,25 @@ class DebateManager:
         # 模型 A: Gemini (策略师)
         if config.GEMINI_API_KEY:
             try:
-                api_key = str(config.GEMINI_API_KEY)
-                self.client_a = genai.Client(api_key=api_key)
+                self.client_a = get_gemini_client(str(config.GEMINI_API_KEY))
             except Exception as e:
                 logger.error(f"Gemini 初始化错误: {e}")
         
         # 模型 B: DeepSeek (审计员)
         if config.DEEPSEEK_API_KEY:
-            api_key = str(config.DEEPSEEK_API_KEY)
-            self.client_b = AsyncOpenAI(
-                api_key=api_key, 
-                base_url="https://api.deepseek.com/v1"
-            )
+            self.client_b = get_deepseek_client(str(config.DEEPSEEK_API_KEY))
+
+        # key -> (stored at, plan); one lock per key so concurrent misses debate only once
+        self._plan_cache: Dict[tuple, Tuple[float, TacticalPlan]] = {}
+        self._plan_locks: Dict[tuple, asyncio.Lock] = {}
+        self._plan_ttl = config.UPDATE_INTERVAL_SECONDS * 2
+
+    def flush(self):
+        """Drops all memoized plans."""
+        self._plan_cache.clear()
 
     async def _call_model_a(self, market_data: dict) -> StrategyProposal:
-        logger.info(f"[策略师] 正在分析 {market_data['symbol']}...")
+        logger.info("[策略师] 正在分析 %s...", market_data['symbol'])
         if not self.client_a:
              logger.warning("[策略师] Gemini API 密钥缺失，使用回退逻辑。")
              return StrategyProposal(symbol=market_data['symbol'], action="WAIT", entry_price=0, stop_loss=0, take_profit=0, reasoning="策略师 API 密钥缺失", confidence_score=0)
@@ -91,11 +181,11 @@ class DebateManager:
             confidence_score=75 if action != "WAIT" else 0
         )
         
-        logger.info(f"[策略师] 提议: {proposal.action} | 置信度: {proposal.confidence_score}% | 推理: {proposal.reasoning}")
+        logger.info("[策略师] 提议: %s | 置信度: %d%% | 推理: %s", proposal.action, proposal.confidence_score, proposal.reasoning)
         return proposal
 
     async def _call_model_b(self, proposal: StrategyProposal, market_data: dict) -> AuditReport:
-        logger.info(f"[审计员] 正在审计 {proposal.symbol} 的 {proposal.action} 提议...")
+        logger.info("[审计员] 正在审计 %s 的 %s 提议...", proposal.symbol, proposal.action)
         if proposal.action == "WAIT":
             return AuditReport(approved=False, risk_flags=[], liquidity_check="不适用", revised_confidence=0, auditor_comment="策略师未提供可执行方案，保持观望。")
         
@@ -111,7 +201,7 @@ class DebateManager:
                 revised_confidence=proposal.confidence_score - (10 if is_extreme_rsi else 0),
                 auditor_comment="[规则引擎] 趋势对齐检查通过。" if approved else "[规则引擎] 驳回：市场处于极端超买/超卖区。"
              )
-             logger.info(f"[审计员] 审计结果: {'通过' if report.approved else '驳回'} | 评论: {report.auditor_comment}")
+             logger.info("[审计员] 审计结果: %s | 评论: %s", '通过' if report.approved else '驳回', report.auditor_comment)
              return report
 
         is_extreme_rsi = market_data['technical']['rsi'] > 80 or market_data['technical']['rsi'] < 20
@@ -124,62 +214,59 @@ class DebateManager:
             revised_confidence=proposal.confidence_score - (10 if is_extreme_rsi else 0),
             auditor_comment="审计员通过趋势对齐检查。" if approved else "审计员驳回：市场处于极端超买/超卖衰竭区。"
         )
-        logger.info(f"[审计员] 审计结果: {'通过' if report.approved else '驳回'} | 评论: {report.auditor_comment}")
+        logger.info("[审计员] 审计结果: %s | 评论: %s", '通过' if report.approved else '驳回', report.auditor_comment)
         return report
 
     def _adjudicate(self, proposal: StrategyProposal, audit: AuditReport) -> TacticalPlan:
-        from datetime import datetime
-        ts = datetime.now().strftime("%H:%M:%S")
+        ts = _timestamp()
 
-        dialogue = []
         # 构建自然语言对话
-        if proposal.action != "WAIT":
-            dialogue.append({"role": "strategist", "content": f"我观察到 {proposal.symbol} 当前处于 {proposal.reasoning}。这看起来是一个不错的机会。"})
-            if audit.approved:
-                dialogue.append({"role": "auditor", "content": f"我已审查该提议。{audit.auditor_comment} 深度图和流动性也符合要求，我同意尝试。"})
-            else:
-                dialogue.append({"role": "auditor", "content": f"我持反对意见。{audit.auditor_comment} 现在的风险回报比并不理想。"})
-        else:
-            dialogue.append({"role": "strategist", "content": "目前市场波动较小或趋势不明朗，我建议继续观望。"})
-            dialogue.append({"role": "auditor", "content": "同意。盲目入场只会增加不必要的风险。"})
+        ctx = {"symbol": proposal.symbol, "reasoning": proposal.reasoning, "comment": audit.auditor_comment}
+        dialogue = [
+            {"role": role, "content": text.format(**ctx)}
+            for role, text in _DIALOGUE_TEMPLATES[(proposal.action, audit.approved)]
+        ]
 
         if not audit.approved or proposal.action == "WAIT":
-            logger.info(f"[裁决者] 决策: 驳回。原因: {audit.auditor_comment}")
-            return TacticalPlan(
-                timestamp=ts,
-                should_trade=False, 
-                symbol=proposal.symbol, 
-                action=proposal.action, 
-                entry=proposal.entry_price, 
-                stop_loss=proposal.stop_loss, 
-                take_profit=proposal.take_profit, 
-                expected_value=0, 
-                rationale=audit.auditor_comment,
-                proposal=proposal,
-                audit=audit,
-                dialogue=dialogue
-            )
-
-        p_win = min(max(audit.revised_confidence / 100.0, 0.3), 0.7)
-        reward = abs(proposal.take_profit - proposal.entry_price)
-        risk = abs(proposal.entry_price - proposal.stop_loss)
+            logger.info("[裁决者] 决策: 驳回。原因: %s", audit.auditor_comment)
+            # Most common outcome: copy the prebuilt skeleton, no validation
+            return _REJECT_TEMPLATE.model_copy(update={
+                'timestamp': ts,
+                'symbol': proposal.symbol,
+                'action': proposal.action,
+                'entry': proposal.entry_price,
+                'stop_loss': proposal.stop_loss,
+                'take_profit': proposal.take_profit,
+                'rationale': audit.auditor_comment,
+                'proposal': proposal,
+                'audit': audit,
+                'dialogue': dialogue
+            })
+
+        c = audit.revised_confidence * 0.01
+        p_win = _P_WIN_LO if c < _P_WIN_LO else _P_WIN_HI if c > _P_WIN_HI else c
+        # Distances measured in the trade's direction; a stop on the wrong side gives risk <= 0
+        side = 1.0 if proposal.action == "LONG" else -1.0
+        reward = side * (proposal.take_profit - proposal.entry_price)
+        risk = side * (proposal.entry_price - proposal.stop_loss)
         
         rr_ratio = reward / risk if risk > 0 else 0
         ev = (p_win * rr_ratio) - ((1 - p_win) * 1.0)
         
         should_trade = ev > self.config.MIN_EXPECTED_VALUE
         
-        logger.info(f"[裁决者] 数学校验: P(胜率)={p_win:.2f}, RR(盈亏比)={rr_ratio:.2f} -> EV(期望值)={ev:.2f} (阈值: {self.config.MIN_EXPECTED_VALUE})")
+        logger.info("[裁决者] 数学校验: P(胜率)=%.2f, RR(盈亏比)=%.2f -> EV(期望值)=%.2f (阈值: %s)", p_win, rr_ratio, ev, self.config.MIN_EXPECTED_VALUE)
         
         status_zh = "执行交易" if should_trade else "拒绝交易 (低期望值)"
-        logger.info(f"[裁决者] 最终决策: {'执行' if should_trade else '跳过'} | {status_zh}")
+        logger.info("[裁决者] 最终决策: %s | %s", '执行' if should_trade else '跳过', status_zh)
         
-        if should_trade:
-            dialogue.append({"role": "adjudicator", "content": f"基于双方陈述与数学计算，当前期望值 (EV) 为 {ev:.2f}，超过阈值。指令已下达，执行 {proposal.action} 策略。"})
-        else:
-            dialogue.append({"role": "adjudicator", "content": f"虽然审计通过，但数学期望值仅为 {ev:.2f}，未达到系统要求的 {self.config.MIN_EXPECTED_VALUE}。本次放弃执行。"})
+        dialogue.append({
+            "role": "adjudicator",
+            "content": _VERDICT_TEMPLATES[should_trade].format(ev=ev, action=proposal.action, min_ev=self.config.MIN_EXPECTED_VALUE)
+        })
 
-        return TacticalPlan(
+        # proposal / audit are already validated; skip revalidating them inside the plan
+        return TacticalPlan.model_construct(
             timestamp=ts,
             should_trade=should_trade,
             symbol=proposal.symbol,
@@ -195,6 +282,60 @@ class DebateManager:
         )
 
     async def generate_tactics(self, market_data: dict) -> TacticalPlan:
+        if not self.config.TACTICS_CACHE_ENABLED:
+            return await self._debate(market_data)
+
+        key = _market_key(market_data)
+        plan = self._cached_plan(key)
+        if plan is None:
+            lock = self._plan_locks.setdefault(key, asyncio.Lock())
+            try:
+                async with lock:
+                    plan = self._cached_plan(key)
+                    if plan is None:
+                        plan = await self._debate(market_data)
+                        self._store_plan(key, plan)
+                        return plan
+            finally:
+                # A failed debate stores no plan, so _store_plan would never prune its lock
+                if key not in self._plan_cache and not lock.locked() and self._plan_locks.get(key) is lock:
+                    del self._plan_locks[key]
+        # Re-stamp the reused plan so the signal history shows when it was issued
+        return plan.model_copy(update={'timestamp': _timestamp()})
+
+    async def generate_tactics_batch(self, data_map: Dict[str, dict]) -> Dict[str, Any]:
+        """
+        Debates a whole scan at once, at most MAX_CONCURRENCY symbols in parallel.
+        Maps each symbol to its plan, or to the exception its debate raised.
+        """
+        sem = asyncio.Semaphore(self.config.MAX_CONCURRENCY)
+
+        async def debate_one(market_data: dict) -> TacticalPlan:
+            async with sem:
+                return await self.generate_tactics(market_data)
+
+        results = await asyncio.gather(
+            *(debate_one(market_data) for market_data in data_map.values()),
+            return_exceptions=True
+        )
+        return dict(zip(data_map, results))
+
+    def _cached_plan(self, key: tuple) -> Optional[TacticalPlan]:
+        entry = self._plan_cache.get(key)
+        if entry and time.monotonic() - entry[0] < self._plan_ttl:
+            return entry[1]
+        return None
+
+    def _store_plan(self, key: tuple, plan: TacticalPlan):
+        now = time.monotonic()
+        for k in [k for k, (ts, _) in self._plan_cache.items() if now - ts >= self._plan_ttl]:
+            del self._plan_cache[k]
+            lock = self._plan_locks.get(k)
+            if lock and not lock.locked():
+                del self._plan_locks[k]
+        self._plan_cache[key] = (now, plan)
+
+    async def _debate(self, market_data: dict) -> TacticalPlan:
         proposal = await self._call_model_a(market_data)
         audit = await self._call_model_b(proposal, market_data)
         plan = self._adjudicate(proposal, audit)
@@ -1,117 +1,251 @@
 
 import asyncio
+import hashlib
 import logging
+import time
 import httpx
 import aiofiles
-from datetime import datetime
+from contextlib import asynccontextmanager
 from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import List, Optional
-from fastapi import FastAPI, BackgroundTasks, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, BackgroundTasks, HTTPException, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from engine import DataEngine
+from engine import DataEngine, close_shared_session
 from logic import DebateManager, TacticalPlan
 from config import BotConfig
 
+class VersionedDeque(deque):
+    """Bounded deque with a counter bumped on every append, so readers can tell when it changed."""
+    def __init__(self, iterable=(), maxlen=None):
+        super().__init__(iterable, maxlen)
+        self.version = 0
+
+    def append(self, item):
+        super().append(item)
+        self.version += 1
+
+class RingBuffer:
+    """Fixed-capacity newest-first history over a preallocated list; snapshots are at most two slices."""
+    def __init__(self, capacity: int):
+        self._buf = [None] * capacity
+        self._cap = capacity
+        self._head = 0
+        self._len = 0
+        self.version = 0
+
+    def appendleft(self, item):
+        self._head = (self._head - 1) % self._cap
+        self._buf[self._head] = item
+        self._len = min(self._len + 1, self._cap)
+        self.version += 1
+
+    def snapshot(self) -> list:
+        end = self._head + self._len
+        if end <= self._cap:
+            return self._buf[self._head:end]
+        return self._buf[self._head:] + self._buf[:end - self._cap]
+
+    def __len__(self):
+        return self._len
+
 # --- Logging Setup with Buffer ---
-log_buffer = deque(maxlen=200) # Keep last 200 logs
+log_buffer = VersionedDeque(maxlen=200) # Keep last 200 logs
 
 class BufferHandler(logging.Handler):
+    # Stores (created, message); the "[HH:MM:SS] message" line is built when /api/status reads it
     def emit(self, record):
         try:
-            msg = self.format(record)
-            log_buffer.append(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
+            log_buffer.append((record.created, record.getMessage()))
         except Exception:
             self.handleError(record)
 
+@lru_cache(maxsize=256)
+def _hms(second: int) -> str:
+    return time.strftime("%H:%M:%S", time.localtime(second))
+
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("sentinel")
+# Re-importing this module (e.g. under reload) must not leave a second handler behind.
+# A re-import defines a new BufferHandler class writing to a new log_buffer, so drop
+# stale instances by class name and attach this module's handler.
+for h in [h for h in logger.handlers if type(h).__name__ == BufferHandler.__name__]:
+    logger.removeHandler(h)
 logger.addHandler(BufferHandler())
 
 # --- Global State ---
+@dataclass(slots=True)
 class SystemState:
     running: bool = False
-    task: asyncio.Task = None
-    config: BotConfig = None
-    engine: DataEngine = None
-    brain: DebateManager = None
-    signals: deque = deque(maxlen=50) # History of AI decisions
-    current_symbol: Optional[str] = None # For "Analyzing" animation
+    stopping: bool = False # /api/stop is winding the previous run down; /api/start must wait
+    task: Optional[asyncio.Task] = None
+    exec_task: Optional[asyncio.Task] = None
+    stop_event: Optional[asyncio.Event] = None # Set by /api/stop; wakes the loop out of its sleeps
+    started_at: float = 0.0 # time.monotonic() at /api/start
+    config: Optional[BotConfig] = None
+    engine: Optional[DataEngine] = None
+    brain: Optional[DebateManager] = None
+    signals: RingBuffer = field(default_factory=lambda: RingBuffer(50)) # History of AI decisions, newest first
+    active_symbols: set = field(default_factory=set) # Symbols being analyzed, for "Analyzing" animation
+    alert_enabled: bool = False # Telegram configured; decided once in /api/start
 
 state = SystemState()
 
 # --- Helpers ---
-async def telegram_alert(message: str, token: str, chat_id: str):
-    if not token or not chat_id: return
+async def telegram_alert(client: httpx.AsyncClient, message: str, token: str, chat_id: str):
     url = f"https://api.telegram.org/bot{token}/sendMessage"
-    async with httpx.AsyncClient() as client:
+    try:
+        await client.post(url, json={"chat_id": chat_id, "text": message})
+    except Exception as e:
+        logger.error(f"Telegram fail: {e}")
+
+# Alerts are queued by the strategy loop and sent off the hot path
+alert_queue: asyncio.Queue = asyncio.Queue()
+
+async def alert_worker(client: httpx.AsyncClient):
+    while True:
+        # Coalesce everything queued since the last send into one message
+        batch = [await alert_queue.get()]
+        while not alert_queue.empty():
+            batch.append(alert_queue.get_nowait())
+        cfg = state.config
+        if state.alert_enabled:
+            await telegram_alert(client, "\n\n".join(batch), cfg.TELEGRAM_BOT_TOKEN, cfg.TELEGRAM_CHAT_ID)
+
+# Orders are placed by exec_worker so analysis never waits on an exchange round-trip
+EXEC_QUEUE_SIZE = 100
+exec_queue: asyncio.Queue = asyncio.Queue(maxsize=EXEC_QUEUE_SIZE)
+
+async def exec_worker():
+    while state.running:
+        symbol, plan = await exec_queue.get()
         try:
-            await client.post(url, json={"chat_id": chat_id, "text": message})
+            await state.engine.execute_strategy(
+                symbol, plan.action, plan.entry, plan.stop_loss, plan.take_profit
+            )
         except Exception as e:
-            logger.error(f"Telegram fail: {e}")
+            logger.error(f"[系统] {symbol} 执行失败: {e}")
+
+async def _wait_for_stop(seconds: float) -> bool:
+    """Sleeps up to `seconds`, returning True as soon as a stop is requested."""
+    try:
+        await asyncio.wait_for(state.stop_event.wait(), timeout=seconds)
+        return True
+    except asyncio.TimeoutError:
+        return False
 
 async def strategy_loop():
     logger.info(">>> 策略引擎循环已启动 <<<")
     
-    while state.running:
+    loop = asyncio.get_running_loop()
+    while not state.stop_event.is_set():
+        cycle_start = loop.time()
         try:
-            if not state.engine or not state.brain:
+            # 本轮使用的对象绑定为局部变量
+            engine, brain, cfg = state.engine, state.brain, state.config
+            if not engine or not brain:
                 logger.error("引擎或大脑未初始化。正在停止。")
                 state.running = False
                 break
+            symbols = cfg.TRADING_SYMBOLS
+            signals_push = state.signals.appendleft
+            alert_enabled = state.alert_enabled
+            log = logger.info
 
-            for symbol in state.config.TRADING_SYMBOLS:
-                if not state.running: break
-                
-                state.current_symbol = symbol
-                logger.info(f"[系统] 正在分析 {symbol}...")
-                
-                # 1. 获取数据
-                data = await state.engine.fetch_market_snapshot(symbol)
-                if not data: 
-                    logger.warning(f"[系统] 无法获取 {symbol} 的数据")
+            # 1. 并发获取所有交易对的数据
+            snapshots = await engine.fetch_all_snapshots(symbols)
+
+            data_map = {}
+            for symbol, data in zip(symbols, snapshots):
+                if not data or isinstance(data, BaseException): 
+                    logger.warning("[系统] 无法获取 %s 的数据", symbol)
                     continue
+                data_map[symbol] = data
+
+            # 2. AI 对抗决策 (整批交易对一起辩论)
+            if logger.isEnabledFor(logging.INFO):
+                for symbol in data_map:
+                    log("[系统] 正在分析 %s...", symbol)
+            state.active_symbols = set(data_map)
+            try:
+                plans = await brain.generate_tactics_batch(data_map)
+            finally:
+                state.active_symbols = set()
+
+            for symbol, plan in plans.items():
+                if state.stop_event.is_set(): break
 
-                # 2. AI 对抗决策
-                plan = await state.brain.generate_tactics(data)
+                if isinstance(plan, BaseException):
+                    logger.error("[系统] %s 分析失败: %s", symbol, plan)
+                    continue
                 
                 # 存储历史
-                state.signals.appendleft(plan)
+                signals_push(plan)
                 
                 # 3. 报告结果
-                log_msg = f"[系统] {symbol} 分析完成: {plan.action} | 期望值: {plan.expected_value} | 是否执行: {plan.should_trade}"
-                logger.info(log_msg)
+                log("[系统] %s 分析完成: %s | 期望值: %s | 是否执行: %s", symbol, plan.action, plan.expected_value, plan.should_trade)
                 
                 if plan.should_trade:
-                    logger.info(f"[系统] 🚨 正在触发 {symbol} 的执行指令 🚨")
-                    await telegram_alert(
-                        f"🚨 信号触发 {symbol} 🚨\n动作: {plan.action}\n入场: {plan.entry}\n理由: {plan.rationale}", 
-                        state.config.TELEGRAM_BOT_TOKEN, state.config.TELEGRAM_CHAT_ID
-                    )
+                    log("[系统] 🚨 正在触发 %s 的执行指令 🚨", symbol)
+                    if alert_enabled:
+                        alert_queue.put_nowait(
+                            f"🚨 信号触发 {symbol} 🚨\n动作: {plan.action}\n入场: {plan.entry}\n理由: {plan.rationale}"
+                        )
                     
-                    # 4. 执行交易
+                    # 4. 执行交易 (交由执行队列，不阻塞分析)
                     try:
-                        await state.engine.execute_strategy(
-                            symbol, plan.action, plan.entry, plan.stop_loss, plan.take_profit
-                        )
-                    except Exception as e:
-                        logger.error(f"[系统] {symbol} 执行失败: {e}")
+                        exec_queue.put_nowait((symbol, plan))
+                    except asyncio.QueueFull:
+                        logger.error(f"[系统] 执行队列已满，丢弃 {symbol} 的 {plan.action} 指令")
             
-            state.current_symbol = None
-            # 等待下一周期
-            await asyncio.sleep(state.config.UPDATE_INTERVAL_SECONDS)
+            # 等待下一周期 (扣除本轮耗时，保持固定节奏)
+            sleep_for = max(0.0, cfg.UPDATE_INTERVAL_SECONDS - (loop.time() - cycle_start))
+            if sleep_for == 0:
+                logger.warning("[系统] 本轮分析耗时超过更新间隔，立即开始下一轮")
+            if await _wait_for_stop(sleep_for):
+                break
             
         except asyncio.CancelledError:
             logger.info("循环已取消。")
             break
         except Exception as e:
             logger.error(f"循环崩溃: {e}")
-            state.current_symbol = None
-            await asyncio.sleep(60)
+            if await _wait_for_stop(60):
+                break
 
 # --- API ---
 
-app = FastAPI(title="Sentinel-Adversary")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The dashboard never changes during a run: read it once and serve it from memory
+    try:
+        async with aiofiles.open("index.html", mode="rb") as f:
+            app.state.index_bytes = await f.read()
+        app.state.index_etag = f'"{hashlib.blake2b(app.state.index_bytes, digest_size=8).hexdigest()}"'
+    except FileNotFoundError:
+        app.state.index_bytes = None
+        app.state.index_etag = None
+    # Long-lived client so outbound alerts reuse keep-alive connections
+    app.state.http = httpx.AsyncClient(
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60)
+    )
+    alert_task = asyncio.create_task(alert_worker(app.state.http))
+    yield
+    # The bot's exchange, loop and order worker use the shared session; wind them down first
+    if state.running:
+        await stop_bot()
+    alert_task.cancel()
+    try:
+        await alert_task
+    except asyncio.CancelledError:
+        pass
+    await app.state.http.aclose()
+    await close_shared_session()
+
+app = FastAPI(title="Sentinel-Adversary", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -122,30 +256,43 @@ app.add_middleware(
 )
 
 @app.get("/", response_class=HTMLResponse)
-async def read_root():
-    try:
-        async with aiofiles.open("index.html", mode="r", encoding="utf-8") as f:
-            content = await f.read()
-        return HTMLResponse(content=content)
-    except FileNotFoundError:
+async def read_root(request: Request):
+    if app.state.index_bytes is None:
         return HTMLResponse(content="<h1>Error: index.html not found</h1>", status_code=404)
+    etag = app.state.index_etag
+    headers = {"etag": etag, "cache-control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=app.state.index_bytes, headers=headers)
+
+# Serialized logs / signals, rebuilt only when either buffer has changed
+_status_cache = {"version": None, "logs": [], "signals": []}
 
 @app.get("/api/status")
 async def get_status():
-    return {
+    version = (log_buffer.version, state.signals.version)
+    if _status_cache["version"] != version:
+        _status_cache["logs"] = [f"[{_hms(int(created))}] {msg}" for created, msg in log_buffer]
+        _status_cache["signals"] = [plan.model_dump() for plan in state.signals.snapshot()]
+        _status_cache["version"] = version
+    # Returned as a response so FastAPI skips jsonable_encoder over the cached lists
+    return ORJSONResponse({
         "running": state.running,
-        "logs": list(log_buffer),
-        "signals": list(state.signals),
-        "current_symbol": state.current_symbol,
-        "uptime": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
+        "logs": _status_cache["logs"],
+        "signals": _status_cache["signals"],
+        "current_symbol": ", ".join(sorted(state.active_symbols)) or None,
+        "uptime": int(time.monotonic() - state.started_at) if state.running else 0 # seconds; formatted by the dashboard
+    })
 
 @app.post("/api/start")
 async def start_bot(config: BotConfig):
     if state.running:
         return {"message": "Already running"}
+    if state.stopping:
+        return {"message": "正在停止，请稍后再启动"}
     
     state.config = config
+    state.alert_enabled = bool(config.TELEGRAM_BOT_TOKEN and config.TELEGRAM_CHAT_ID)
     
     try:
         logger.info("[系统] 正在初始化数据引擎...")
@@ -160,25 +307,43 @@ async def start_bot(config: BotConfig):
         raise HTTPException(status_code=400, detail=f"初始化失败: {str(e)}")
 
     state.running = True
+    state.started_at = time.monotonic()
+    state.stop_event = asyncio.Event()
     state.task = asyncio.create_task(strategy_loop())
+    state.exec_task = asyncio.create_task(exec_worker())
     
     return {"message": "哨兵系统已启动"}
 
+STOP_GRACE_SECONDS = 5
+
 @app.post("/api/stop")
 async def stop_bot():
     if not state.running:
         return {"message": "未在运行"}
     
     state.running = False
-    if state.task:
-        state.task.cancel()
-        try:
-            await state.task
-        except asyncio.CancelledError:
-            pass
-            
-    if state.engine:
-        await state.engine.close()
-        
+    state.stopping = True
+    state.stop_event.set()
+    try:
+        # Let the loop leave on its own (sleeps wake immediately); cancel only if a cycle is mid-flight
+        if state.task:
+            await asyncio.wait({state.task}, timeout=STOP_GRACE_SECONDS)
+        for task in (state.task, state.exec_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        # Orders still queued belong to the stopped run; never place them after a restart
+        while not exec_queue.empty():
+            exec_queue.get_nowait()
+
+        if state.engine:
+            await state.engine.close()
+    finally:
+        state.stopping = False
+
     logger.info(">>> 系统已停止 <<<")
     return {"message": "哨兵系统已停止"}